@@ -1,7 +1,40 @@
-from typing import Union, Iterable, List, Tuple, Mapping
+import logging
+import threading
+from typing import Union, Iterable, List, Tuple, Mapping, Callable
+
+logger = logging.getLogger(__name__)
 
 
 class FriendStore:
+    def __init__(self):
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """
+        Register a callback that is invoked with the identifier of a friend after it was added to the store.
+        """
+        with self._listeners_lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str], None]):
+        """
+        Remove a callback registered with :meth:`add_listener`.
+        """
+        with self._listeners_lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _notify_added(self, identifier: str):
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(identifier)
+            except Exception:
+                logger.exception("Failed to notify listener %s about friend %s", listener, identifier)
+
     def add_friend(self, identifier: str, names: Union[str, Iterable[str]],
                    scenario_id: str = None, mention_id: str = None) -> str:
         """
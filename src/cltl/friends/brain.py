@@ -41,6 +41,8 @@ class BrainFriendsStore(FriendStore):
                 self._create_speaker_capsule(scenario_id, mention_id, uri, identifier, name),
                 create_label=True)
 
+        self._notify_added(identifier)
+
         return str(uri) if uri is not None else None
 
     def get_friend(self, identifier: str) -> Tuple[str, List[str]]:
@@ -11,6 +11,7 @@ class MemoryFriendsStore(FriendStore):
     def add_friend(self, identifier: str, names: Union[str, Iterable[str]],
                    scenario_id: str = None, mention_id: str = None) -> str:
         self._friends[identifier] = (None, names)
+        self._notify_added(identifier)
 
         return None
 
@@ -76,5 +76,5 @@ class BDIService:
                 intentions_payload = [Intention(intention, None) for intention in self._intentions]
                 self._event_bus.publish(self._intention_topic, Event.for_payload(IntentionEvent(intentions_payload)))
                 logger.info("Achieved %s, set intentions to %s", event.payload.achieved[0], intentions_payload)
-        except:
+        except Exception:
             logger.exception("Failed to process achieved desire %s for intentions %s", event.payload, self._intentions)
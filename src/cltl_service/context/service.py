@@ -203,5 +203,5 @@ class ContextService:
     def _get_location(self):
         try:
             return requests.get("https://ipinfo.io").json()
-        except:
+        except (requests.RequestException, ValueError):
             return {"country": "", "region": "", "city": ""}
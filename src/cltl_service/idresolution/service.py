@@ -1,7 +1,10 @@
 import logging
+import threading
 import time
+from collections import OrderedDict
 
 from cltl.commons.discrete import UtteranceType
+from cltl.combot.event.emissor import ScenarioStopped
 from cltl.combot.infra.config import ConfigurationManager
 from cltl.combot.infra.event import Event, EventBus
 from cltl.combot.infra.resource import ResourceManager
@@ -14,40 +17,76 @@ from cltl.friends.api import FriendStore
 logger = logging.getLogger(__name__)
 
 
+ID_TIMEOUT = 25.0
+ID_POLL_INTERVAL = 0.5
+FRIEND_CACHE_SIZE = 1024
+FRIEND_CACHE_TTL = 60.0
+PUBLISH_BATCH_SIZE = 16
+PUBLISH_DELAY = 0.05
+
+
 class IdResolutionService:
+    __slots__ = ("_event_bus", "_resource_manager", "_speaker_topic", "_knowledge_topic", "_scenario_topic",
+                 "_match_cases", "_topic_worker", "_scenario_worker", "_emissor_client", "_friend_store",
+                 "_scenario", "_scenario_id", "_id_events", "_id_events_lock", "_friend_cache", "_friend_cache_lock",
+                 "_pending", "_pending_lock", "_flush_timer")
+
     @classmethod
     def from_config(cls, friend_store: FriendStore, emissor_client: EmissorDataClient,
                     event_bus: EventBus, resource_manager: ResourceManager, config_manager: ConfigurationManager):
         config = config_manager.get_config("cltl.leolani.idresolution")
         speaker_topic = config.get("topic_speaker")
         knowledge_topic = config.get("topic_knowledge")
+        scenario_topic = config.get("topic_scenario") if "topic_scenario" in config else None
         match_cases = "match_cases" in config and config.get_boolean("match_cases")
 
         return cls(speaker_topic, knowledge_topic, match_cases,
-                   friend_store, emissor_client, event_bus, resource_manager)
+                   friend_store, emissor_client, event_bus, resource_manager, scenario_topic=scenario_topic)
 
     def __init__(self, speaker_topic: str, knowledge_topic: str, match_cases: bool,
                  friend_store: FriendStore, emissor_client: EmissorDataClient,
-                 event_bus: EventBus, resource_manager: ResourceManager):
+                 event_bus: EventBus, resource_manager: ResourceManager, scenario_topic: str = None):
         self._event_bus = event_bus
         self._resource_manager = resource_manager
 
         self._speaker_topic = speaker_topic
         self._knowledge_topic = knowledge_topic
+        self._scenario_topic = scenario_topic
 
         self._match_cases = match_cases
 
         self._topic_worker = None
+        self._scenario_worker = None
 
         self._emissor_client = emissor_client
         self._friend_store = friend_store
         self._scenario = None
+        self._scenario_id = None
+
+        self._id_events = dict()
+        self._id_events_lock = threading.Lock()
+
+        self._friend_cache = OrderedDict()
+        self._friend_cache_lock = threading.Lock()
+
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
 
     @property
     def app(self):
         return None
 
     def start(self, timeout=30):
+        self._friend_store.add_listener(self._on_friend_added)
+        if self._scenario_topic:
+            # Separate worker, such that scenario updates are not delayed by speaker events awaiting their ID
+            self._scenario_worker = TopicWorker([self._scenario_topic], self._event_bus,
+                                                processor=self._update_scenario,
+                                                resource_manager=self._resource_manager,
+                                                name=self.__class__.__name__ + "Scenario")
+            self._scenario_worker.start().wait()
+
         self._topic_worker = TopicWorker([self._speaker_topic],
                                          self._event_bus, provides=[self._knowledge_topic],
                                          buffer_size=32, processor=self._process,
@@ -63,87 +102,185 @@ class IdResolutionService:
         self._topic_worker.await_stop()
         self._topic_worker = None
 
+        if self._scenario_worker:
+            self._scenario_worker.stop()
+            self._scenario_worker.await_stop()
+            self._scenario_worker = None
+
+        self._flush()
+
+        self._friend_store.remove_listener(self._on_friend_added)
+
     def _process(self, event: Event):
         mention = event.payload.mentions[0]
         signal_id = mention.segment[0].container_id
-        name_annotation = next(iter(filter(lambda a: a.type == "Entity", mention.annotations)))
-        id_annotation = next(iter(filter(lambda a: a.type == "VectorIdentity", mention.annotations)))
+        name_annotation, id_annotation = self._get_annotations(mention)
+
+        identity, speaker_name = id_annotation.value, name_annotation.value.text
+
+        # Resolve the ID once for both matching strategies
+        id_uri = self._await_friend(identity) if identity != speaker_name or self._match_cases else None
+        logger.debug("Found uri %s for id %s", id_uri, identity)
 
-        capsule = [self._same_as(signal_id, id_annotation.value, name_annotation.value.text)]
+        capsule = [self._same_as(signal_id, identity, speaker_name, id_uri)]
         if self._match_cases:
-            capsule.append(self._case_insensitive_same_as(signal_id, id_annotation.value, name_annotation.value.text))
+            capsule.append(self._case_insensitive_same_as(signal_id, speaker_name, id_uri))
         capsule = list(filter(None, capsule))
 
         if capsule:
-            self._event_bus.publish(self._knowledge_topic, Event.for_payload(capsule))
-            logger.info("Resolved identity %s to name %s (%s)",
-                        id_annotation.value, name_annotation.value.text, capsule)
+            self._publish(capsule)
+            logger.info("Resolved identity %s to name %s (%s)", identity, speaker_name, capsule)
         else:
-            logger.info("No identity resolution for %s with name %s", id_annotation.value, name_annotation.value.text)
-
-    def _same_as(self, signal_id, id, speaker_name):
-        if id == speaker_name:
+            logger.info("No identity resolution for %s with name %s", identity, speaker_name)
+
+    def _get_annotations(self, mention):
+        name_annotation, id_annotation = None, None
+        for annotation in mention.annotations:
+            if annotation.type == "Entity" and name_annotation is None:
+                name_annotation = annotation
+            elif annotation.type == "VectorIdentity" and id_annotation is None:
+                id_annotation = annotation
+            if name_annotation and id_annotation:
+                break
+
+        if name_annotation is None or id_annotation is None:
+            raise ValueError(f"Missing Entity or VectorIdentity annotation in mention {mention.id}")
+
+        return name_annotation, id_annotation
+
+    def _update_scenario(self, event: Event):
+        if isinstance(event.payload, ScenarioStopped):
+            self._scenario_id = None
+        else:
+            self._scenario_id = event.payload.scenario.id
+        logger.debug("Set scenario to %s", self._scenario_id)
+
+    def _current_scenario_id(self):
+        if self._scenario_id:
+            return self._scenario_id
+
+        return self._emissor_client.get_current_scenario_id()
+
+    def _publish(self, capsules):
+        """
+        Collect capsules and publish them in a single event once the batch is full or the delay passed.
+        """
+        with self._pending_lock:
+            self._pending.extend(capsules)
+            if len(self._pending) < PUBLISH_BATCH_SIZE:
+                if not self._flush_timer:
+                    self._flush_timer = threading.Timer(PUBLISH_DELAY, self._flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+                return
+
+        self._flush()
+
+    def _flush(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+        if not batch:
+            return
+
+        try:
+            self._event_bus.publish(self._knowledge_topic, Event.for_payload(batch))
+            logger.debug("Published %s capsules", len(batch))
+        except Exception:
+            logger.exception("Failed to publish %s capsules: %s", len(batch), batch)
+
+    def _on_friend_added(self, identifier: str):
+        with self._friend_cache_lock:
+            self._friend_cache.pop(identifier, None)
+        with self._id_events_lock:
+            id_event = self._id_events.get(identifier)
+        if id_event:
+            id_event.set()
+
+    def _get_friend_uri(self, identifier):
+        """
+        Cached lookup of the friend URI, only resolved URIs are cached and expire after FRIEND_CACHE_TTL seconds.
+        """
+        with self._friend_cache_lock:
+            if identifier in self._friend_cache:
+                uri, expires = self._friend_cache[identifier]
+                if time.monotonic() < expires:
+                    self._friend_cache.move_to_end(identifier)
+                    return uri
+                del self._friend_cache[identifier]
+
+        uri, _ = self._friend_store.get_friend(identifier)
+
+        if uri:
+            with self._friend_cache_lock:
+                self._friend_cache[identifier] = uri, time.monotonic() + FRIEND_CACHE_TTL
+                self._friend_cache.move_to_end(identifier)
+                if len(self._friend_cache) > FRIEND_CACHE_SIZE:
+                    self._friend_cache.popitem(last=False)
+
+        return uri
+
+    def _await_friend(self, id):
+        """
+        Storing the new ID happens in parallel, wait until it is added to the FriendStore.
+
+        Notifications from the FriendStore wake up the wait immediately, the store is re-queried periodically
+        in case the ID is stored without notification (e.g. by another process).
+        """
+        with self._id_events_lock:
+            id_event = self._id_events.setdefault(id, threading.Event())
+
+        try:
+            deadline = time.monotonic() + ID_TIMEOUT
+            id_uri = self._get_friend_uri(id)
+            while not id_uri and time.monotonic() < deadline:
+                id_event.wait(timeout=min(ID_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+                id_event.clear()
+                id_uri = self._get_friend_uri(id)
+        finally:
+            with self._id_events_lock:
+                self._id_events.pop(id, None)
+
+        return id_uri
+
+    def _same_as(self, signal_id, id, speaker_name, id_uri):
+        if id == speaker_name or not id_uri:
             return None
 
-        name_uri, _ = self._friend_store.get_friend(speaker_name)
+        name_uri = self._get_friend_uri(speaker_name)
 
-        # Storing new ID happens in parallel
-        id_uri, attempt = None, 0
-        while not id_uri and attempt < 50:
-            id_uri, _ = self._friend_store.get_friend(id)
-            time.sleep(0.5 if not id_uri else 0.0)
-            attempt += 1
+        logger.debug("Found name_uri %s for speaker %s", name_uri, speaker_name)
 
-        logger.debug("Found uri %s for id %s in attempt %s, name_uri %s", id_uri, id, attempt, name_uri)
-
-        if not id_uri or not name_uri or name_uri == id_uri:
+        if not name_uri or name_uri == id_uri:
             return None
 
-        scenario_id = self._emissor_client.get_current_scenario_id()
-
-        capsule = {
-            "chat": scenario_id,
-            "turn": signal_id,
-            "author": {"label": "Leolani", "type": ["robot"],
-                       'uri': "http://cltl.nl/leolani/world/leolani"},
-            "utterance": "",
-            "utterance_type": UtteranceType.STATEMENT,
-            "position": "",
-            "subject": {"label": speaker_name, "type": ["person"],
-                        'uri': id_uri},
-            "predicate": {"label": None, "uri": "http://www.w3.org/2002/07/owl#sameAs"},
-            "object": {"label": speaker_name, "type": ["person"],
-                       'uri': name_uri},
-            "perspective": {"certainty": 1, "polarity": 0, "sentiment": 0},
-            "timestamp": timestamp_now(),
-            "context_id": scenario_id
-        }
-
-        return capsule
-
-    def _case_insensitive_same_as(self, signal_id, id, speaker_name):
-        # Storing new ID happens in parallel
-        id_uri, attempt = None, 0
-        while not id_uri and attempt < 50:
-            id_uri, _ = self._friend_store.get_friend(id)
-            time.sleep(0.5 if not id_uri else 0.0)
-            attempt += 1
+        return self._build_sameas_capsule(signal_id, speaker_name, id_uri, name_uri)
 
-        logger.debug("Found uri %s for id %s in attempt %s for case matching", id_uri, id, attempt)
-
-        if not id_uri or id_uri.split('/')[-1].lower().startswith(speaker_name.lower()):
+    def _case_insensitive_same_as(self, signal_id, speaker_name, id_uri):
+        if not id_uri:
             logger.debug("Not matching uri %s for speaker %s", id_uri, speaker_name)
             return None
 
-        scenario_id = self._emissor_client.get_current_scenario_id()
+        head, _, tail = id_uri.rpartition('/')
+        tail_lower = tail.lower()
+        if tail_lower.startswith(speaker_name.lower()):
+            logger.debug("Not matching uri %s for speaker %s", id_uri, speaker_name)
+            return None
 
-        uri_parts = id_uri.split('/')
-        title_uri = '/'.join(uri_parts[:-1]) + '/' + uri_parts[-1].title()
-        lower_case_uri = '/'.join(uri_parts[:-1]) + '/' + uri_parts[-1].lower()
+        title_uri = f"{head}/{tail.title()}"
+        lower_case_uri = f"{head}/{tail_lower}"
 
         logger.debug("Matched uri %s and %s", title_uri, lower_case_uri)
 
-        capsule = {
+        return self._build_sameas_capsule(signal_id, speaker_name, title_uri, lower_case_uri)
+
+    def _build_sameas_capsule(self, signal_id, speaker_name, subject_uri, object_uri):
+        scenario_id = self._current_scenario_id()
+
+        return {
             "chat": scenario_id,
             "turn": signal_id,
             "author": {"label": "Leolani", "type": ["robot"],
@@ -151,14 +288,10 @@ class IdResolutionService:
             "utterance": "",
             "utterance_type": UtteranceType.STATEMENT,
             "position": "",
-            "subject": {"label": speaker_name, "type": ["person"],
-                        'uri': title_uri},
+            "subject": {"label": speaker_name, "type": ["person"], 'uri': subject_uri},
             "predicate": {"label": None, "uri": "http://www.w3.org/2002/07/owl#sameAs"},
-            "object": {"label": speaker_name, "type": ["person"],
-                       'uri': lower_case_uri},
+            "object": {"label": speaker_name, "type": ["person"], 'uri': object_uri},
             "perspective": {"certainty": 1, "polarity": 0, "sentiment": 0},
             "timestamp": timestamp_now(),
             "context_id": scenario_id
         }
-
-        return capsule
\ No newline at end of file
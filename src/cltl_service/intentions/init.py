@@ -1,7 +1,10 @@
+import itertools
 import logging
+import operator
 import random
 import re
-from typing import Mapping
+import threading
+from typing import Mapping, Callable, Optional
 
 from cltl.commons.language_data.sentences import GREETING, GOODBYE
 from cltl.combot.event.bdi import DesireEvent
@@ -20,10 +23,19 @@ logger = logging.getLogger(__name__)
 TIMEOUT = 120_000
 
 
-_GREETINGS = [re.sub('[^a-z]+', '', greeting.lower()) for greeting in GREETING]
+_NON_LETTERS = re.compile('[^a-zA-Z]+')
+_GREETINGS = [_NON_LETTERS.sub('', greeting).lower() for greeting in GREETING]
+_GREETING_RE = re.compile('|'.join(map(re.escape, _GREETINGS)), re.IGNORECASE)
+_START_RE = re.compile('yes', re.IGNORECASE)
+_ANNOTATION_VALUE = operator.attrgetter('value')
 
 
 class InitService:
+    __slots__ = ("_event_bus", "_resource_manager", "_emissor_client",
+                 "_intention_topic", "_desire_topic", "_text_in_topic", "_text_out_topic", "_face_topic",
+                 "_greeting", "_topic_worker", "_intention_worker", "_reset_timer", "_reset_lock", "_scheduled_greeting",
+                 "_handlers")
+
     @classmethod
     def from_config(cls, emissor_client: EmissorDataClient,
                     event_bus: EventBus, resource_manager: ResourceManager, config_manager: ConfigurationManager):
@@ -54,15 +66,23 @@ class InitService:
         self._greeting = greeting
 
         self._topic_worker = None
+        self._intention_worker = None
+
+        self._reset_timer = None
+        self._reset_lock = threading.Lock()
+        self._scheduled_greeting = False
 
-        self._timeout = None
+        self._handlers = dict()
 
     @property
     def app(self):
         return None
 
     def start(self, timeout=30):
-        self._topic_worker = TopicWorker(list(filter(bool, [self._face_topic, self._text_in_topic])),
+        handlers = {self._face_topic: self._handle_face, self._text_in_topic: self._handle_text}
+        self._handlers = {topic: handler for topic, handler in handlers.items() if topic}
+
+        self._topic_worker = TopicWorker(list(self._handlers),
                                          self._event_bus, provides=[self._text_out_topic],
                                          intentions=["init"], intention_topic=self._intention_topic,
                                          resource_manager=self._resource_manager, processor=self._process,
@@ -70,6 +90,13 @@ class InitService:
                                          name=self.__class__.__name__)
         self._topic_worker.start().wait()
 
+        # Not restricted to the init intention, to cancel a pending reset when the intention changes
+        self._intention_worker = TopicWorker([self._intention_topic], self._event_bus,
+                                             resource_manager=self._resource_manager,
+                                             processor=self._update_intention,
+                                             name=self.__class__.__name__ + "Intention")
+        self._intention_worker.start().wait()
+
     def stop(self):
         if not self._topic_worker:
             pass
@@ -78,45 +105,104 @@ class InitService:
         self._topic_worker.await_stop()
         self._topic_worker = None
 
+        self._intention_worker.stop()
+        self._intention_worker.await_stop()
+        self._intention_worker = None
+
+        with self._reset_lock:
+            self._cancel_reset_timer()
+
     def _process(self, event: Event):
         if not self._greeting:
             self._event_bus.publish(self._desire_topic, Event.for_payload(DesireEvent(["initialized"])))
             logger.info("Initialized without greeting")
             return
 
-        timestamp = timestamp_now()
+        handler = self._handlers.get(event.metadata.topic) if event else self._handle_scheduled
+        if handler:
+            with self._reset_lock:
+                action = handler(event)
+            if action:
+                action()
+                return
 
-        scheduled_invocation = event is None
-        if (scheduled_invocation or self._face_or_keyword(event)) and not self._timeout:
-            greeting = random.choice(GREETING) + " " + self._greeting
-            self._event_bus.publish(self._text_out_topic, Event.for_payload(self._create_text_signal_event(greeting)))
-            self._timeout = timestamp
-            logger.info("Start initialization")
-        elif scheduled_invocation:
-            pass
-        elif self._timeout and timestamp - self._timeout < TIMEOUT and self._start_utterance(event):
-            self._timeout = None
-            self._event_bus.publish(self._desire_topic, Event.for_payload(DesireEvent(["initialized"])))
-            logger.info("Interaction initialized")
-        elif self._timeout and timestamp - self._timeout > TIMEOUT:
-            self._timeout = None
-            goodbye = random.choice(GOODBYE) + " Let me know when you are back."
-            self._event_bus.publish(self._text_out_topic, Event.for_payload(self._create_text_signal_event(goodbye)))
-            logger.info("Reset initialization")
-
-        logger.debug("Unhandled event %s (%s - %s)", event, timestamp, self._timeout)
-
-    def _start_utterance(self, event):
-        return event.metadata.topic == self._text_in_topic and "yes" in event.payload.signal.text.lower()
-
-    def _face_or_keyword(self, event):
-        if event.metadata.topic == self._face_topic:
-            return any(annotation.value
-                for mention in event.payload.mentions
-                for annotation in mention.annotations)
-        if event.metadata.topic == self._text_in_topic:
-            utterance = re.sub('[^a-z]+', '', event.payload.signal.text.lower())
-            return any(greeting in utterance for greeting in _GREETINGS)
+        logger.debug("Unhandled event %s", event)
+
+    def _update_intention(self, event: Event):
+        if not hasattr(event.payload, "intentions"):
+            return
+
+        if "init" not in {intention.label for intention in event.payload.intentions}:
+            with self._reset_lock:
+                if self._reset_timer:
+                    logger.debug("Cancelled initialization reset, intention changed to %s", event.payload.intentions)
+                self._cancel_reset_timer()
+                self._scheduled_greeting = False
+
+    # The handlers update the state while holding the lock and return the action to perform after releasing it
+
+    def _handle_scheduled(self, event: Event = None) -> Optional[Callable[[], None]]:
+        # Greet only once by schedule, until someone shows up or the intention changes
+        if self._reset_timer or self._scheduled_greeting:
+            return None
+
+        self._scheduled_greeting = True
+        self._start_reset_timer()
+        return self._greet
+
+    def _handle_face(self, event: Event) -> Optional[Callable[[], None]]:
+        if self._reset_timer:
+            return None
+
+        annotations = itertools.chain.from_iterable(mention.annotations for mention in event.payload.mentions)
+        if not any(map(_ANNOTATION_VALUE, annotations)):
+            return None
+
+        self._scheduled_greeting = False
+        self._start_reset_timer()
+        return self._greet
+
+    def _handle_text(self, event: Event) -> Optional[Callable[[], None]]:
+        text = event.payload.signal.text
+        if not self._reset_timer and _GREETING_RE.search(_NON_LETTERS.sub('', text)):
+            self._scheduled_greeting = False
+            self._start_reset_timer()
+            return self._greet
+        if self._reset_timer and _START_RE.search(text):
+            self._cancel_reset_timer()
+            return self._initialized
+
+        return None
+
+    def _greet(self):
+        greeting = random.choice(GREETING) + " " + self._greeting
+        self._event_bus.publish(self._text_out_topic, Event.for_payload(self._create_text_signal_event(greeting)))
+        logger.info("Start initialization")
+
+    def _initialized(self):
+        self._event_bus.publish(self._desire_topic, Event.for_payload(DesireEvent(["initialized"])))
+        logger.info("Interaction initialized")
+
+    def _start_reset_timer(self):
+        self._reset_timer = threading.Timer(TIMEOUT / 1000, self._reset_init)
+        self._reset_timer.daemon = True
+        self._reset_timer.start()
+
+    def _cancel_reset_timer(self):
+        if self._reset_timer:
+            self._reset_timer.cancel()
+        self._reset_timer = None
+
+    def _reset_init(self):
+        with self._reset_lock:
+            if threading.current_thread() is not self._reset_timer:
+                # Cancelled or re-armed in the meantime
+                return
+            self._reset_timer = None
+
+        goodbye = random.choice(GOODBYE) + " Let me know when you are back."
+        self._event_bus.publish(self._text_out_topic, Event.for_payload(self._create_text_signal_event(goodbye)))
+        logger.info("Reset initialization")
 
     def _create_text_signal_event(self, text: str):
         scenario_id = self._emissor_client.get_current_scenario_id()
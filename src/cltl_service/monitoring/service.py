@@ -29,7 +29,7 @@ try:
     system_fonts = matplotlib.font_manager.findSystemFonts(fontpaths=None, fontext='ttf')
     arial = next(f for f in system_fonts if 'arial' in f.lower() and 'bold' in f.lower())
     FONT = ImageFont.truetype(arial, 25)
-except:
+except Exception:
     FONT = ImageFont.load_default()
 
 